@@ -1,29 +1,128 @@
+import hashlib
+import io
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import pyarrow as pa
 
-from processing import impute_missing_values, handle_outliers, apply_rules, calculate_estimates
-from reporting import generate_report_html, create_pdf_report
+from processing import downcast_numeric, impute_missing_values, run_pipeline
+from reporting import generate_report_html, generate_report_html_for_pdf, create_pdf_report
 
 st.set_page_config(layout="wide")
 st.title("🤖 AI Enhanced Application for Survey Data")
 
+def read_csv_fast(raw_bytes):
+    """Parses a CSV with pyarrow's multithreaded reader, giving the same frame as the C parser.
+
+    pyarrow keeps repeated headers as duplicate labels, so the header names are
+    taken from the C parser instead (a, a.1). pyarrow also turns date- and
+    time-like columns into date objects where the C parser keeps the strings;
+    such files are re-read with the C parser.
+    """
+    df = pd.read_csv(io.BytesIO(raw_bytes), engine='pyarrow')
+    for i, dtype in enumerate(df.dtypes):
+        if pd.api.types.is_datetime64_any_dtype(dtype) or (
+            dtype == object and pd.api.types.infer_dtype(df.iloc[:, i], skipna=True) in ('date', 'time', 'datetime')
+        ):
+            return pd.read_csv(io.BytesIO(raw_bytes), engine='c')
+    # Only the header line is parsed here
+    df.columns = pd.read_csv(io.BytesIO(raw_bytes), nrows=0, engine='c').columns
+    return df
+
+def export_cleaned(df):
+    """Serializes the cleaned data for download. Returns (data, extension, mime).
+
+    Parquet is preferred, but pyarrow cannot type mixed object columns (e.g. numbers
+    and "N/A" in an Excel sheet); those frames are exported as CSV instead.
+    """
+    try:
+        return df.to_parquet(index=False), 'parquet', 'application/octet-stream'
+    except pa.ArrowException:
+        return df.to_csv(index=False).encode(), 'csv', 'text/csv'
+
+# Cached helpers: Streamlit reruns the whole script on every widget change,
+# so parsing, processing and charting are keyed on their inputs and reused.
+# The caches are shared by all sessions, so each one keeps a bounded number of entries.
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_frame(file_hash, _raw_bytes, name):
+    """Parses an uploaded CSV or Excel file; keyed on the file hash, not the bytes."""
+    if name.endswith('.csv'):
+        df = read_csv_fast(_raw_bytes)
+    else:
+        df = pd.read_excel(io.BytesIO(_raw_bytes))
+    if 'Employment_Status' in df.columns:
+        # Categorical codes make the validation rule an integer compare
+        df['Employment_Status'] = df['Employment_Status'].astype('category')
+    return downcast_numeric(df)
+
+# The processing helpers take the frame as _df (excluded from the cache key) and are
+# keyed on the uploaded file's hash instead, so the frame is not re-hashed per call.
+@st.cache_data(show_spinner=False, max_entries=8)
+def imputed_frame(file_hash, _df, imputation_cols, imputation_method):
+    """Imputes a working copy of the uploaded frame.
+
+    Cached separately so that changing only the outlier or weight settings
+    does not refit the imputer (KNN in particular is expensive).
+    """
+    # Imputation works in place; keep the cached raw frame intact for the preview
+    return impute_missing_values(_df.copy(), list(imputation_cols), imputation_method)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_pipeline(file_hash, _df, imputation_cols, imputation_method, outlier_cols, weight_column):
+    """Runs the processing pipeline on top of the cached imputation."""
+    # imputed_frame returns a fresh copy, so the later in-place stages never touch _df
+    def impute(df, columns, method):
+        return imputed_frame(file_hash, df, tuple(columns), method)
+
+    return run_pipeline(
+        _df, list(imputation_cols), imputation_method, list(outlier_cols), weight_column, impute=impute
+    )
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def render_pdf(html_string):
+    """Renders a report to PDF bytes; WeasyPrint is the slowest step in the app."""
+    return create_pdf_report(html_string)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def estimates_chart(df_estimates):
+    """Bar chart comparing weighted and unweighted means."""
+    return px.bar(
+        df_estimates, x='Variable', y=['Unweighted Mean', 'Weighted Mean'],
+        barmode='group', title="Weighted vs. Unweighted Mean Estimates"
+    )
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def distribution_chart(run_key, _df, column):
+    """Histogram of a single column of the cleaned data produced by run_key."""
+    return px.histogram(_df, x=column, title=f'Distribution of {column}')
+
 # Initialize session state keys
 if "df_final" not in st.session_state:
     st.session_state.df_final = None
     st.session_state.df_estimates = None
     st.session_state.logs = None
     st.session_state.fig = None
+    st.session_state.describe_df = None
+    st.session_state.numeric_cols = None
+    st.session_state.pdf_report = None
+    st.session_state.cleaned_export = None
+    st.session_state.file_id = None
+    st.session_state.file_hash = None
+    st.session_state.run_key = None
 
 # File Uploader
 uploaded_file = st.file_uploader("Upload your raw survey file (CSV or Excel)", type=["csv", "xlsx"])
 
 if uploaded_file:
     try:
-        if uploaded_file.name.endswith('.csv'):
-            df_raw = pd.read_csv(uploaded_file)
-        else:
-            df_raw = pd.read_excel(uploaded_file)
+        raw_bytes = uploaded_file.getvalue()
+        # Hash each upload once; reruns reuse it as the cache key for the file
+        if st.session_state.file_id != uploaded_file.file_id:
+            st.session_state.file_id = uploaded_file.file_id
+            st.session_state.file_hash = hashlib.blake2b(raw_bytes, digest_size=8).hexdigest()
+        file_hash = st.session_state.file_hash
+        df_raw = load_frame(file_hash, raw_bytes, uploaded_file.name)
     except Exception as e:
         st.error(f"Error reading file: {e}")
         st.stop()
@@ -48,28 +147,34 @@ if uploaded_file:
     # Processing
     if st.sidebar.button("🚀 Run Analysis"):
         with st.spinner("Processing data..."):
-            logs = []
+            df_final, df_estimates, logs = cached_pipeline(
+                file_hash, df_raw, tuple(imputation_cols), imputation_method, tuple(outlier_cols), weight_column
+            )
             
-            df_imputed, log = impute_missing_values(df_raw, columns=imputation_cols, method=imputation_method)
-            logs.append(log)
-            df_outliers_handled, log = handle_outliers(df_imputed, columns=outlier_cols)
-            logs.append(log)
-            df_validated, log = apply_rules(df_outliers_handled)
-            logs.append(log)
-            df_estimates, log = calculate_estimates(df_validated, weight_column=weight_column)
-            logs.append(log)
-            
-            st.session_state.df_final = df_validated
+            # Derived results are computed once per run rather than on every rerun of the
+            # display block, and all before any is stored, so session_state never holds a
+            # half-updated run
+            describe_df = df_final.describe()
+            numeric_cols = df_final.select_dtypes(include='number').columns.tolist()
+            cleaned_export = export_cleaned(df_final)
+            if df_estimates is not None and not df_estimates.empty:
+                fig = estimates_chart(df_estimates)
+            else:
+                fig = None
+
+            st.session_state.df_final = df_final
+            # Identifies this run's results as a cache key, without hashing the frames
+            st.session_state.run_key = (
+                file_hash, tuple(imputation_cols), imputation_method, tuple(outlier_cols), weight_column
+            )
             st.session_state.df_estimates = df_estimates
             st.session_state.logs = logs
-            
-            if st.session_state.df_estimates is not None and not st.session_state.df_estimates.empty:
-                st.session_state.fig = px.bar(
-                    st.session_state.df_estimates, x='Variable', y=['Unweighted Mean', 'Weighted Mean'],
-                    barmode='group', title="Weighted vs. Unweighted Mean Estimates"
-                )
-            else:
-                st.session_state.fig = None
+            st.session_state.describe_df = describe_df
+            st.session_state.numeric_cols = numeric_cols
+            st.session_state.cleaned_export = cleaned_export
+            st.session_state.fig = fig
+            # A PDF prepared for the previous results is stale now
+            st.session_state.pdf_report = None
 
 # Display Results
 if st.session_state.df_final is not None:
@@ -79,7 +184,7 @@ if st.session_state.df_final is not None:
     st.dataframe(st.session_state.df_final)
     
     st.subheader("Full Descriptive Statistics (Cleaned Data)")
-    st.dataframe(st.session_state.df_final.describe())
+    st.dataframe(st.session_state.describe_df)
 
     st.subheader("Summary Estimates")
     st.dataframe(st.session_state.df_estimates)
@@ -91,14 +196,10 @@ if st.session_state.df_final is not None:
     st.subheader("Data Distributions")
     column_to_plot = st.selectbox(
         "Select a numeric column to see its distribution:",
-        st.session_state.df_final.select_dtypes(include='number').columns
+        st.session_state.numeric_cols
     )
     if column_to_plot:
-        fig_hist = px.histogram(
-            st.session_state.df_final,
-            x=column_to_plot,
-            title=f'Distribution of {column_to_plot}'
-        )
+        fig_hist = distribution_chart(st.session_state.run_key, st.session_state.df_final, column_to_plot)
         st.plotly_chart(fig_hist, use_container_width=True)
     
     st.subheader("Processing Logs")
@@ -116,7 +217,7 @@ if st.session_state.df_final is not None:
         uploaded_file.name  # <-- This is the new argument
     )
 
-    dl_col1, dl_col2 = st.columns(2)
+    dl_col1, dl_col2, dl_col3 = st.columns(3)
     
     with dl_col1:
         st.download_button(
@@ -127,10 +228,32 @@ if st.session_state.df_final is not None:
         )
         
     with dl_col2:
-        pdf_report = create_pdf_report(html_report)
+        # Rendering a PDF takes seconds, so only do it on request rather than on every rerun
+        if st.button("Prepare PDF"):
+            with st.spinner("Rendering PDF..."):
+                # WeasyPrint does not run JavaScript, so the PDF gets a static chart image
+                pdf_html_report = generate_report_html_for_pdf(
+                    st.session_state.df_final,
+                    st.session_state.df_estimates,
+                    st.session_state.logs,
+                    st.session_state.fig,
+                    uploaded_file.name
+                )
+                st.session_state.pdf_report = render_pdf(pdf_html_report)
+        if st.session_state.pdf_report is not None:
+            st.download_button(
+                label="Download as PDF",
+                data=st.session_state.pdf_report,
+                file_name=f"report_{uploaded_file.name}.pdf",
+                mime="application/pdf"
+            )
+        
+    with dl_col3:
+        # Reports only embed a preview, so the full cleaned data is offered on its own
+        export_data, export_extension, export_mime = st.session_state.cleaned_export
         st.download_button(
-            label="Download as PDF",
-            data=pdf_report,
-            file_name=f"report_{uploaded_file.name}.pdf",
-            mime="application/pdf"
+            label=f"Download cleaned data ({export_extension.upper()})",
+            data=export_data,
+            file_name=f"cleaned_{uploaded_file.name}.{export_extension}",
+            mime=export_mime
         )
@@ -1,67 +1,153 @@
 import pandas as pd
 import numpy as np
-from sklearn.impute import SimpleImputer, KNNImputer
+from joblib import Parallel, delayed
+from sklearn.impute import KNNImputer
 from scipy.stats import iqr
 
-def impute_missing_values(df, columns, method='median'):
-    """Handles missing values in specified columns."""
-    df_imputed = df.copy()
+try:
+    from numba import njit
+except ImportError:  # numba is optional; _clip_count falls back to NumPy
+    njit = None
+
+# Largest number of rows KNNImputer is fitted on; bigger inputs are subsampled
+KNN_MAX_FIT_ROWS = 10_000
+
+def downcast_numeric(df):
+    """Downcasts 64-bit numeric columns to the narrowest dtype that holds them, in place.
+
+    Floats become float32 (about 7 significant digits), which is ample for survey
+    responses and halves the memory traffic of every later processing stage.
+    """
+    for col in df.select_dtypes(include='float64').columns:
+        df[col] = pd.to_numeric(df[col], downcast='float')
+    for col in df.select_dtypes(include='int64').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def impute_missing_values(df, columns, method='median', copy=False):
+    """Handles missing values in specified columns, in place unless copy=True."""
+    df_imputed = df.copy() if copy else df
     numeric_cols = df_imputed[columns].select_dtypes(include=np.number).columns.tolist()
     
     if not numeric_cols:
         return df_imputed, "No numeric columns selected for imputation."
 
-    if method == 'Mean':
-        imputer = SimpleImputer(strategy='mean')
-    elif method == 'KNN':
+    if method == 'KNN':
+        # Kept in float64: nan_euclidean distances cancel catastrophically in float32
+        # once a column holds large values (e.g. incomes in the millions)
+        X = df_imputed[numeric_cols].to_numpy(dtype=np.float64)
         imputer = KNNImputer(n_neighbors=5)
-    else: # Median is the default
-        imputer = SimpleImputer(strategy='median')
-        
-    df_imputed[numeric_cols] = imputer.fit_transform(df_imputed[numeric_cols])
+        if len(X) > KNN_MAX_FIT_ROWS:
+            # Fit on a fixed random sample so the neighbour search stays linear in N
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(X), KNN_MAX_FIT_ROWS, replace=False)
+            # A sparse column may have no observed value in the sample, and KNNImputer
+            # would drop it; add one observed donor row for each such column
+            observed = ~np.isnan(X)
+            unseen = np.flatnonzero(observed.any(axis=0) & ~observed[sample].any(axis=0))
+            donors = [np.flatnonzero(observed[:, j])[0] for j in unseen]
+            imputer.fit(X[np.concatenate([sample, donors]).astype(int)])
+        else:
+            imputer.fit(X)
+        df_imputed[numeric_cols] = imputer.transform(X)
+    else:
+        if method == 'Mean':
+            stats = df_imputed[numeric_cols].mean()
+        else: # Median is the default
+            stats = df_imputed[numeric_cols].median()
+        df_imputed[numeric_cols] = df_imputed[numeric_cols].fillna(stats)
     log_message = f"Imputed missing values in columns {numeric_cols} using {method}."
     return df_imputed, log_message
 
-def handle_outliers(df, columns, method='IQR'):
-    """Handles outliers in specified columns using IQR method."""
-    df_outliers_handled = df.copy()
+if njit is not None:
+    @njit(cache=True, nogil=True)
+    def _clip_count(values, lower, upper):
+        """Clips values to [lower, upper] in place and returns how many were clipped, in one pass."""
+        n_clipped = 0
+        for i in range(values.size):
+            v = values[i]
+            if v < lower:
+                values[i] = lower
+                n_clipped += 1
+            elif v > upper:
+                values[i] = upper
+                n_clipped += 1
+        return n_clipped
+else:
+    def _clip_count(values, lower, upper):
+        """Clips values to [lower, upper] in place and returns how many were clipped."""
+        n_clipped = np.count_nonzero((values < lower) | (values > upper))
+        if n_clipped:
+            np.clip(values, lower, upper, out=values)
+        return n_clipped
+
+def _cap_one(values):
+    """Caps a single column at the IQR fences, in place. Returns (lower, upper, values, n_outliers)."""
+    # One sort yields both quartiles
+    Q1, Q3 = np.nanpercentile(values, [25, 75])
+    IQR = Q3 - Q1
+    lower_bound = Q1 - 1.5 * IQR
+    upper_bound = Q3 + 1.5 * IQR
+
+    # Capping the outliers (Winsorization)
+    n_outliers = _clip_count(values, lower_bound, upper_bound)
+    return lower_bound, upper_bound, values, n_outliers
+
+def handle_outliers(df, columns, method='IQR', copy=False):
+    """Handles outliers in specified columns using IQR method, in place unless copy=True."""
+    df_outliers_handled = df.copy() if copy else df
     log_messages = []
     
-    # Only process columns that exist in the dataframe
-    valid_columns = [col for col in columns if col in df_outliers_handled.columns]
+    # Only process numeric columns that exist in the dataframe
+    valid_columns = [
+        col for col in columns
+        if col in df_outliers_handled.columns and pd.api.types.is_numeric_dtype(df_outliers_handled[col])
+    ]
     
-    for col in valid_columns:
-        if pd.api.types.is_numeric_dtype(df_outliers_handled[col]):
-            Q1 = df_outliers_handled[col].quantile(0.25)
-            Q3 = df_outliers_handled[col].quantile(0.75)
-            IQR = Q3 - Q1
-            lower_bound = Q1 - 1.5 * IQR
-            upper_bound = Q3 + 1.5 * IQR
-            
-            outliers = df_outliers_handled[(df_outliers_handled[col] < lower_bound) | (df_outliers_handled[col] > upper_bound)]
-            if not outliers.empty:
-                log_messages.append(f"Found {len(outliers)} outlier(s) in '{col}' using {method}.")
-                # Capping the outliers (Winsorization)
-                df_outliers_handled[col] = np.where(df_outliers_handled[col] < lower_bound, lower_bound, df_outliers_handled[col])
-                df_outliers_handled[col] = np.where(df_outliers_handled[col] > upper_bound, upper_bound, df_outliers_handled[col])
-                log_messages.append(f"Capped outliers in '{col}' at lower:{lower_bound:.2f} and upper:{upper_bound:.2f}.")
-            else:
-                log_messages.append(f"No outliers detected in '{col}' using {method}.")
+    # Columns are independent and the NumPy kernels release the GIL, so threads suffice.
+    # Each job gets an owned float buffer (float32 where that is exact) so the column can be capped in place.
+    results = Parallel(n_jobs=-1, prefer='threads', batch_size=4)(
+        delayed(_cap_one)(
+            df_outliers_handled[col].to_numpy(dtype=np.result_type(df_outliers_handled[col].dtype, np.float32), copy=True)
+        )
+        for col in valid_columns
+    )
+    
+    for col, (lower_bound, upper_bound, values, n_outliers) in zip(valid_columns, results):
+        if n_outliers:
+            log_messages.append(f"Found {n_outliers} outlier(s) in '{col}' using {method}.")
+            df_outliers_handled[col] = values
+            log_messages.append(f"Capped outliers in '{col}' at lower:{lower_bound:.2f} and upper:{upper_bound:.2f}.")
+        else:
+            log_messages.append(f"No outliers detected in '{col}' using {method}.")
 
     if not log_messages:
         log_messages.append("No numeric columns selected for outlier handling.")
 
     return df_outliers_handled, "\n".join(log_messages)
 
-def apply_rules(df):
-    """Applies a simple validation rule."""
-    df_validated = df.copy()
+def apply_rules(df, copy=False):
+    """Applies a simple validation rule, in place unless copy=True."""
+    df_validated = df.copy() if copy else df
     # Rule: If Age < 18, Employment_Status should not be 'Employed'.
     if 'Age' in df_validated.columns and 'Employment_Status' in df_validated.columns:
-        violations = df_validated[(df_validated['Age'] < 18) & (df_validated['Employment_Status'] == 'Employed')]
-        if not violations.empty:
-            log_message = f"Found {len(violations)} rule violation(s): Age < 18 and Employed. Correcting status to 'Unemployed'."
-            df_validated.loc[violations.index, 'Employment_Status'] = 'Unemployed'
+        status = df_validated['Employment_Status']
+        is_categorical = isinstance(status.dtype, pd.CategoricalDtype)
+        if is_categorical:
+            # Compare integer category codes instead of strings
+            if 'Employed' in status.cat.categories:
+                employed = status.cat.codes.to_numpy() == status.cat.categories.get_loc('Employed')
+            else:
+                employed = np.zeros(len(status), dtype=bool)
+        else:
+            employed = status.to_numpy() == 'Employed'
+        mask = (df_validated['Age'].to_numpy() < 18) & employed
+        n_violations = int(mask.sum())
+        if n_violations:
+            log_message = f"Found {n_violations} rule violation(s): Age < 18 and Employed. Correcting status to 'Unemployed'."
+            if is_categorical and 'Unemployed' not in status.cat.categories:
+                df_validated['Employment_Status'] = status.cat.add_categories('Unemployed')
+            df_validated.loc[mask, 'Employment_Status'] = 'Unemployed'
         else:
             log_message = "No rule violations found."
     else:
@@ -74,21 +160,49 @@ def calculate_estimates(df, weight_column):
     if weight_column not in df.columns:
         return pd.DataFrame(), f"Weight column '{weight_column}' not found in the dataframe."
         
-    summary = {}
-    numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
+    numeric_cols = [col for col in df.select_dtypes(include=np.number).columns if col != weight_column]
+    # Project to the numeric columns and drop unweighted rows once, up front
+    df_weighted = df.loc[df[weight_column].notna(), numeric_cols + [weight_column]]
     
-    for col in numeric_cols:
-        if col != weight_column:
-            # Drop rows where the variable or weight is NaN for accurate calculation
-            valid_data = df[[col, weight_column]].dropna()
-            if not valid_data.empty:
-                unweighted_mean = valid_data[col].mean()
-                weighted_mean = np.average(valid_data[col], weights=valid_data[weight_column])
-                summary[col] = {'Unweighted Mean': unweighted_mean, 'Weighted Mean': weighted_mean}
-            
-    if not summary:
+    # Reduce all variables at once; NaNs are masked out per column
+    values = df_weighted[numeric_cols].to_numpy(dtype=np.float64, copy=True)
+    w = df_weighted[weight_column].to_numpy(dtype=np.float64)
+    mask = ~np.isnan(values)
+    values[~mask] = 0.0
+    counts = mask.sum(axis=0)
+    has_data = counts > 0
+    if not has_data.any():
         return pd.DataFrame(), "No valid numeric columns to generate estimates for."
 
-    summary_df = pd.DataFrame(summary).T.reset_index().rename(columns={'index': 'Variable'})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unweighted = values.sum(axis=0) / counts
+        # The weight vector is streamed once for all variables
+        weighted = np.einsum('ij,i->j', values, w) / (mask.T @ w)
+
+    summary_df = pd.DataFrame({
+        'Variable': pd.Index(numeric_cols)[has_data],
+        'Unweighted Mean': unweighted[has_data],
+        'Weighted Mean': weighted[has_data],
+    })
     log_message = f"Calculated weighted and unweighted means using '{weight_column}'."
     return summary_df, log_message
+
+def run_pipeline(df, imputation_cols, imputation_method, outlier_cols, weight_column, impute=impute_missing_values):
+    """Runs the full cleaning and estimation pipeline in a single pass.
+
+    Every stage works in place on df, so pass a copy if the input must be preserved.
+    impute can be swapped for a (cached) stage with the same signature as
+    impute_missing_values.
+    """
+    logs = []
+
+    df_final, log = impute(df, columns=imputation_cols, method=imputation_method)
+    logs.append(log)
+    df_final, log = handle_outliers(df_final, columns=outlier_cols)
+    logs.append(log)
+    df_final, log = apply_rules(df_final)
+    logs.append(log)
+    df_estimates, log = calculate_estimates(df_final, weight_column=weight_column)
+    logs.append(log)
+
+    return df_final, df_estimates, logs
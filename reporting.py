@@ -1,55 +1,108 @@
+import base64
+import html
+import io
+
+import numpy as np
 import pandas as pd
 from weasyprint import HTML
 import plotly.graph_objects as go
 
+# Rows of the cleaned data embedded in reports; the full data is downloaded separately
+REPORT_PREVIEW_ROWS = 1000
+
+_REPORT_HEAD = """
+<html>
+<head>
+    <title>Survey Data Analysis Report for {filename}</title>
+    <style>
+        body {{ font-family: sans-serif; margin: 2em; }}
+        h1, h2 {{ color: #333; }}
+        .styled-table {{
+            border-collapse: collapse; margin: 25px 0; font-size: 0.9em;
+            min-width: 400px; box-shadow: 0 0 20px rgba(0, 0, 0, 0.15);
+        }}
+        .styled-table thead tr {{
+            background-color: #009879; color: #ffffff; text-align: left;
+        }}
+        .styled-table th, .styled-table td {{ padding: 12px 15px; }}
+        .styled-table tbody tr {{ border-bottom: 1px solid #dddddd; }}
+        .styled-table tbody tr:nth-of-type(even) {{ background-color: #f3f3f3; }}
+        pre {{
+            background-color: #eee; padding: 10px; border: 1px solid #ddd;
+            white-space: pre-wrap;
+        }}
+    </style>
+</head>
+<body>
+    <h1>Survey Data Analysis Report for: {filename}</h1>
+"""
+
+_REPORT_FOOT = """
+</body>
+</html>
+"""
+
 def generate_report_html(df_final, df_estimates, logs, chart_fig, filename):
     """Compiles all results into a single, interactive HTML string."""
-    
-    final_table_html = df_final.to_html(classes='styled-table', index=False)
-    estimates_table_html = df_estimates.to_html(classes='styled-table', index=False)
-    
     if chart_fig:
-        chart_html = chart_fig.to_html(full_html=False, include_plotlyjs=True)
+        # Load plotly.js from the CDN rather than inlining ~3 MB of it
+        chart_html = chart_fig.to_html(full_html=False, include_plotlyjs='cdn')
+    else:
+        chart_html = "<p>No chart to display.</p>"
+
+    return _render_report(df_final, df_estimates, logs, chart_html, filename)
+
+def generate_report_html_for_pdf(df_final, df_estimates, logs, chart_fig, filename):
+    """Compiles all results into an HTML string for PDF rendering, with the chart as a static PNG."""
+    if chart_fig:
+        try:
+            png = chart_fig.to_image(format='png')
+            chart_html = f'<img src="data:image/png;base64,{base64.b64encode(png).decode()}"/>'
+        except (ImportError, ValueError, RuntimeError) as e:
+            # kaleido (or the Chrome it drives) is missing or failed to render
+            chart_html = f"<p>Chart could not be rendered for PDF: {html.escape(str(e))}</p>"
     else:
         chart_html = "<p>No chart to display.</p>"
 
-    logs_html = "<pre>" + "\n".join(logs) + "</pre>"
-    
-    # The only change is adding the filename to the h1 tag below
-    html_string = f"""
-    <html>
-    <head>
-        <title>Survey Data Analysis Report for {filename}</title>
-        <style>
-            body {{ font-family: sans-serif; margin: 2em; }}
-            h1, h2 {{ color: #333; }}
-            .styled-table {{
-                border-collapse: collapse; margin: 25px 0; font-size: 0.9em;
-                min-width: 400px; box-shadow: 0 0 20px rgba(0, 0, 0, 0.15);
-            }}
-            .styled-table thead tr {{
-                background-color: #009879; color: #ffffff; text-align: left;
-            }}
-            .styled-table th, .styled-table td {{ padding: 12px 15px; }}
-            .styled-table tbody tr {{ border-bottom: 1px solid #dddddd; }}
-            .styled-table tbody tr:nth-of-type(even) {{ background-color: #f3f3f3; }}
-            pre {{
-                background-color: #eee; padding: 10px; border: 1px solid #ddd;
-                white-space: pre-wrap;
-            }}
-        </style>
-    </head>
-    <body>
-        <h1>Survey Data Analysis Report for: {filename}</h1>
-        <h2>Final Cleaned Data</h2>{final_table_html}
-        <h2>Summary Estimates</h2>{estimates_table_html}
-        <h2>Visualizations</h2>{chart_html}
-        <h2>Processing Logs</h2>{logs_html}
-    </body>
-    </html>
+    return _render_report(df_final, df_estimates, logs, chart_html, filename)
+
+def _format_float(value):
+    """Shortest string that round-trips the value at its own precision, never in scientific notation.
+
+    Integral values such as IDs stay exact, and float32 columns do not print binary noise.
     """
-    return html_string
+    return np.format_float_positional(value, trim='-')
+
+def _render_report(df_final, df_estimates, logs, chart_html, filename):
+    """Writes the report piece by piece into one buffer, so the large tables and
+    chart markup are never concatenated into intermediate strings."""
+    buf = io.StringIO()
+    buf.write(_REPORT_HEAD.format(filename=filename))
+
+    buf.write("<h2>Final Cleaned Data</h2>")
+    if len(df_final) > REPORT_PREVIEW_ROWS:
+        buf.write(
+            f"<p>Preview of the first {REPORT_PREVIEW_ROWS} of {len(df_final)} rows; "
+            f"the full data is available as a separate download.</p>"
+        )
+    # A plain format callable skips pandas' per-column precision search
+    df_final.head(REPORT_PREVIEW_ROWS).to_html(
+        buf, classes='styled-table', index=False, border=0, float_format=_format_float
+    )
+
+    buf.write("<h2>Summary Estimates</h2>")
+    df_estimates.to_html(buf, classes='styled-table', index=False)
+
+    buf.write("<h2>Visualizations</h2>")
+    buf.write(chart_html)
+
+    buf.write("<h2>Processing Logs</h2><pre>")
+    buf.write("\n".join(logs))
+    buf.write("</pre>")
+
+    buf.write(_REPORT_FOOT)
+    return buf.getvalue()
 
 def create_pdf_report(html_string):
     """Converts an HTML string directly to PDF bytes."""
-    return HTML(string=html_string).write_pdf()
+    return HTML(string=html_string).write_pdf(presentational_hints=True, optimize_images=True)